@@ -5,13 +5,13 @@ import argparse
 import os
 
 import numpy as np
-import xarray as xr
 import dask
 from dask.distributed import Client
 
 from config import preprocessed_dir, mask_dir, uncertainty_dir, SNOW_YEAR
 from luts import inv_cgf_codes
 from shared_utils import (
+    netcdf_chunks,
     open_preprocessed_dataset,
     apply_threshold,
     fetch_raster_profile,
@@ -46,7 +46,7 @@ def count_darkness(dark_on):
     """
 
     logging.info("Counting occurence of dark values...")
-    darkness_count = dark_on.sum(dim="time")
+    darkness_count = dark_on.sum(dim="time", dtype=np.int32)
     return darkness_count
 
 
@@ -343,13 +343,11 @@ if __name__ == "__main__":
     if smoothed_input is not None:
         logging.info(f"Using smoothed input file: {smoothed_input}")
         fp = preprocessed_dir / f"snow_year_{SNOW_YEAR}_{tile_id}_{smoothed_input}.nc"
-        ds = open_preprocessed_dataset(fp, {"x": "auto", "y": "auto"}).to_dataarray()[0]
+        ds = open_preprocessed_dataset(fp, netcdf_chunks).to_dataarray()[0]
         output_tag = smoothed_input
     else:
         fp = preprocessed_dir / f"snow_year_{SNOW_YEAR}_{tile_id}.nc"
-        ds = open_preprocessed_dataset(
-            fp, {"x": "auto", "y": "auto"}, "CGF_NDSI_Snow_Cover"
-        )
+        ds = open_preprocessed_dataset(fp, netcdf_chunks, "CGF_NDSI_Snow_Cover")
         output_tag = "raw"
 
     # intialize input and output parameters
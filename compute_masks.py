@@ -3,18 +3,27 @@
 import argparse
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 
+import dask
 import numpy as np
+import xarray as xr
 from dask.distributed import Client
 
 from config import SNOW_YEAR, preprocessed_dir, mask_dir
 from luts import n_obs_to_classify_ocean, n_obs_to_classify_inland_water, inv_cgf_codes
 from shared_utils import (
+    netcdf_chunks,
     open_preprocessed_dataset,
     fetch_raster_profile,
     write_tagged_geotiff,
 )
 
+# class codes compared against every observation, resolved once at import
+ocean_code = np.uint8(inv_cgf_codes["Ocean"])
+inland_water_code = np.uint8(inv_cgf_codes["Lake / Inland water"])
+l2_fill_code = np.uint8(inv_cgf_codes["L2 fill"])
+
 
 def generate_l2fill_mask(ds_chunked):
     """Create a mask of grid cells with a constant time series of L2 fill no data values.
@@ -27,53 +36,55 @@ def generate_l2fill_mask(ds_chunked):
     logging.info(
         "Computing no data mask of grid cells with a constant time series of L2 fill no data values."
     )
-    l2fill_mask = (ds_chunked != inv_cgf_codes["L2 fill"]).all(dim="time")
+    l2fill_mask = (ds_chunked != l2_fill_code).all(dim="time")
     return l2fill_mask
 
 
-def generate_ocean_mask(ds_chunked):
-    """Create a mask of ocean grid cells.
+def count_water_observations(snow_cover):
+    """Count ocean and lake / inland water observations along the last (time) axis of a block.
 
-    Locations where the number of ocean observations exceeds the threshold in a given snow year are classified as ocean for that entire snow year. Such grid cells will be excluded (masked) from the snow metric computation.
+    Both counts are taken from the same in-memory block, so the snow cover data is only read and decompressed once for the two water masks.
 
     Args:
-        ds_chunked (xarray.Dataset): The chunked dataset.
+        snow_cover (np.array): N-D array of snow cover values with time as the last axis.
 
     Returns:
-        xarray.DataArray: The ocean mask.
+        tuple of np.array: The per grid cell counts of ocean and of lake / inland water observations.
     """
-    logging.info(
-        f"Computing ocean mask of grid cells where count of ocean observations exceeds {n_obs_to_classify_ocean} for the snow year."
-    )
-    ocean_mask = (
-        ds_chunked.where(ds_chunked == inv_cgf_codes["Ocean"]).count(dim="time")
-        <= n_obs_to_classify_ocean
-    )
-    return ocean_mask
+    # a snow year of counts fits easily in int32
+    ocean_count = (snow_cover == ocean_code).sum(axis=-1, dtype=np.int32)
+    inland_water_count = (snow_cover == inland_water_code).sum(axis=-1, dtype=np.int32)
+    return ocean_count, inland_water_count
 
 
-def generate_inland_water_mask(ds_chunked):
-    """Create a mask of lake / inland water grid cells.
+def generate_water_masks(ds_chunked):
+    """Create masks of ocean and of lake / inland water grid cells.
 
-    Locations where the number of lake / inland water observations exceeds the threshold in a given snow year are classified as lake / inland water for that entire snow year. Such grid cells will be excluded (masked) from the snow metric computation.
+    Locations where the number of ocean (or lake / inland water) observations exceeds the threshold in a given snow year are classified as ocean (or lake / inland water) for that entire snow year. Such grid cells will be excluded (masked) from the snow metric computation. Both observation counts are computed in a single pass over each block.
 
     Args:
-        ds_chunked (xarray.Dataset): The chunked dataset.
+        ds_chunked (xarray.DataArray): The chunked snow cover data.
 
     Returns:
-        xarray.DataArray: The lake / inland water mask.
+        tuple of xarray.DataArray: The ocean mask and the lake / inland water mask.
     """
-
+    logging.info(
+        f"Computing ocean mask of grid cells where count of ocean observations exceeds {n_obs_to_classify_ocean} for the snow year."
+    )
     logging.info(
         f"Computing lake / inland water mask of grid cells where count of lake / inland water observations exceeds {n_obs_to_classify_inland_water} for the snow year."
     )
-    inland_water_mask = (
-        ds_chunked.where(ds_chunked == inv_cgf_codes["Lake / Inland water"]).count(
-            dim="time"
-        )
-        <= n_obs_to_classify_inland_water
+    ocean_count, inland_water_count = xr.apply_ufunc(
+        count_water_observations,
+        ds_chunked,
+        input_core_dims=[["time"]],
+        output_core_dims=[[], []],
+        dask="parallelized",
+        output_dtypes=[np.int32, np.int32],
     )
-    return inland_water_mask
+    ocean_mask = ocean_count <= n_obs_to_classify_ocean
+    inland_water_mask = inland_water_count <= n_obs_to_classify_inland_water
+    return ocean_mask, inland_water_mask
 
 
 def combine_masks(mask_list):
@@ -88,10 +99,66 @@ def combine_masks(mask_list):
         xarray.DataArray: The combined mask of grid cells.
     """
     logging.info("Combining masks...")
-    masks_combined = np.all(mask_list, axis=0)
+    # AND in place rather than stacking the masks into a new (n, y, x) array
+    masks_combined = np.array(mask_list[0], dtype=bool)
+    for mask in mask_list[1:]:
+        masks_combined &= np.asarray(mask)
     return masks_combined
 
 
+def main(tile_id):
+    """Compute and write the masks for a single tile.
+
+    Args:
+        tile_id (str): The tile identifier.
+    Returns:
+        None
+    """
+    logging.info(f"Creating masks for tile {tile_id} for snow year {SNOW_YEAR}.")
+    with Client(n_workers=24):
+        fp = preprocessed_dir / f"snow_year_{SNOW_YEAR}_{tile_id}.nc"
+        ds = open_preprocessed_dataset(fp, netcdf_chunks, "CGF_NDSI_Snow_Cover")
+
+        ocean_mask, inland_water_mask = generate_water_masks(ds)
+        l2_mask = generate_l2fill_mask(ds)
+        # compute together so each block of the cube is read once for all masks
+        ocean_mask, inland_water_mask, l2_mask = dask.compute(
+            ocean_mask, inland_water_mask, l2_mask
+        )
+        combined_mask = combine_masks([ocean_mask, inland_water_mask, l2_mask])
+
+        # masks are 0/1 so pack them at one bit per grid cell; 0 is a valid "masked" value, not no data
+        # write_tagged_geotiff leaves out the predictor at this bit depth, GDAL rejects it below 8 bits
+        mask_profile = fetch_raster_profile(
+            tile_id, {"dtype": "uint8", "nodata": None, "nbits": 1}
+        )
+        # boolean masks are written as 0/1 values of the uint8 mask profile
+        masks = {
+            "ocean": ocean_mask.values.astype(np.uint8),
+            "inland_water": inland_water_mask.values.astype(np.uint8),
+            "l2_fill": l2_mask.values.astype(np.uint8),
+            "combined": combined_mask.astype(np.uint8),
+        }
+        # GDAL releases the GIL while compressing and writing, so overlap the writes
+        with ThreadPoolExecutor(max_workers=len(masks)) as executor:
+            futures = [
+                executor.submit(
+                    write_tagged_geotiff,
+                    mask_dir,
+                    tile_id,
+                    "_mask",
+                    mask_name,
+                    mask_profile,
+                    mask_arr,
+                )
+                for mask_name, mask_arr in masks.items()
+            ]
+            for future in futures:
+                future.result()
+        ds.close()
+    print("Mask Generation Script Complete.")
+
+
 if __name__ == "__main__":
     log_file_path = os.path.join(os.path.expanduser("~"), "mask_computation.log")
     logging.basicConfig(filename=log_file_path, level=logging.INFO)
@@ -100,41 +167,4 @@ if __name__ == "__main__":
     parser.add_argument("tile_id", type=str, help="VIIRS Tile ID (ex. h11v02)")
     args = parser.parse_args()
     tile_id = args.tile_id
-    logging.info(f"Creating masks for tile {tile_id} for snow year {SNOW_YEAR}.")
-    client = Client(n_workers=24)
-    fp = preprocessed_dir / f"snow_year_{SNOW_YEAR}_{tile_id}.nc"
-    ds = open_preprocessed_dataset(
-        fp, {"x": "auto", "y": "auto"}, "CGF_NDSI_Snow_Cover"
-    )
-
-    ocean_mask = generate_ocean_mask(ds)
-    inland_water_mask = generate_inland_water_mask(ds)
-    l2_mask = generate_l2fill_mask(ds)
-    combined_mask = combine_masks([ocean_mask, inland_water_mask, l2_mask])
-
-    mask_profile = fetch_raster_profile(tile_id, {"dtype": "int8", "nodata": 0})
-    write_tagged_geotiff(
-        mask_dir, tile_id, "_mask", "ocean", mask_profile, ocean_mask.values
-    )
-    write_tagged_geotiff(
-        mask_dir,
-        tile_id,
-        "_mask",
-        "inland_water",
-        mask_profile,
-        inland_water_mask.values,
-    )
-    write_tagged_geotiff(
-        mask_dir,
-        tile_id,
-        "_mask",
-        "l2_fill",
-        mask_profile,
-        l2_mask.values,
-    )
-    write_tagged_geotiff(
-        mask_dir, tile_id, "_mask", "combined", mask_profile, combined_mask
-    )
-    ds.close()
-    client.close()
-    print("Mask Generation Script Complete.")
+    main(tile_id)
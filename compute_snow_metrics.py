@@ -5,7 +5,6 @@ import argparse
 import calendar
 import os
 
-import rasterio as rio
 import numpy as np
 import xarray as xr
 from dask.distributed import Client
@@ -18,10 +17,10 @@ from config import (
 )
 from luts import (
     snow_cover_threshold,
-    inv_cgf_codes,
     css_days_threshold,
 )
 from shared_utils import (
+    netcdf_chunks,
     open_preprocessed_dataset,
     fetch_raster_profile,
     apply_threshold,
@@ -96,7 +95,7 @@ def count_snow_days(snow_on):
     Returns:
         xr.DataArray: integer values representing the number of snow days in the snow season.
     """
-    return snow_on.sum(dim="time")
+    return snow_on.sum(dim="time", dtype=np.int32)
 
 
 def count_no_snow_days(cgf_snow_darkness_filled):
@@ -109,7 +108,7 @@ def count_no_snow_days(cgf_snow_darkness_filled):
         xr.DataArray: integer values representing the number of no-snow days in the snow season.
     """
     snow_off_days = cgf_snow_darkness_filled <= snow_cover_threshold
-    return snow_off_days.sum(dim="time")
+    return snow_off_days.sum(dim="time", dtype=np.int32)
 
 
 def compute_full_snow_season_range(lsd_array, fsd_array):
@@ -240,6 +239,73 @@ def compute_css_metrics(snow_on):
     return css_metric_dict
 
 
+def main(tile_id, alt_input=None):
+    """Compute and write the snow metrics for a single tile.
+
+    Args:
+        tile_id (str): The tile identifier.
+        alt_input (str): optional alternate input file indicated by filename suffix
+    Returns:
+        None
+    """
+    logging.info(f"Computing snow metrics for tile {tile_id}.")
+    # A Dask LocalCluster speeds this script up 10X
+    with Client(n_workers=9) as client:
+        print("Monitor the Dask client dashboard for progress at the link below:")
+        print(client.dashboard_link)
+        if alt_input is not None:
+            logging.info(f"Using alternate input file: {alt_input}")
+            fp = preprocessed_dir / f"snow_year_{SNOW_YEAR}_{tile_id}_{alt_input}.nc"
+            chunky_ds = open_preprocessed_dataset(
+                fp, netcdf_chunks, "CGF_NDSI_Snow_Cover"
+            )
+        else:
+            fp = (
+                preprocessed_dir / f"snow_year_{SNOW_YEAR}_{tile_id}_filtered_filled.nc"
+            )
+            chunky_ds = open_preprocessed_dataset(
+                fp, netcdf_chunks, "CGF_NDSI_Snow_Cover"
+            )
+
+        logging.info(f"Applying Snow Cover Threshold...")
+        snow_is_on = apply_threshold(chunky_ds)
+        snow_metrics = dict()
+        snow_metrics.update({"first_snow_day": get_first_snow_day_array(snow_is_on)})
+        snow_metrics.update({"last_snow_day": get_last_snow_day_array(snow_is_on)})
+
+        snow_metrics.update(
+            {
+                "fss_range": compute_full_snow_season_range(
+                    snow_metrics["last_snow_day"], snow_metrics["first_snow_day"]
+                )
+            }
+        )
+        snow_metrics.update({"snow_days": count_snow_days(snow_is_on)})
+        snow_metrics.update({"no_snow_days": count_no_snow_days(chunky_ds)})
+        snow_metrics.update(compute_css_metrics(snow_is_on))
+
+        # iterate through keys in snow_metrics dict and apply mask
+        combined_mask = mask_dir / f"{tile_id}__mask_combined_{SNOW_YEAR}.tif"
+        for metric_name, metric_array in snow_metrics.items():
+            snow_metrics[metric_name] = apply_mask(combined_mask, metric_array)
+
+        single_metric_profile = fetch_raster_profile(
+            tile_id, {"dtype": "int16", "nodata": 0}
+        )
+        for metric_name, metric_array in snow_metrics.items():
+            write_tagged_geotiff(
+                single_metric_dir,
+                tile_id,
+                "",
+                metric_name,
+                single_metric_profile,
+                metric_array.compute().values.astype("int16"),
+                # don't have to call .compute(), but communicates a chunked DataArray input
+            )
+    chunky_ds.close()
+    print("Snow Metric Computation Script Complete.")
+
+
 if __name__ == "__main__":
     log_file_path = os.path.join(os.path.expanduser("~"), "snow_metric_computation.log")
     logging.basicConfig(filename=log_file_path, level=logging.INFO)
@@ -252,60 +318,4 @@ if __name__ == "__main__":
     )
     args = parser.parse_args()
     tile_id = args.tile_id
-    logging.info(f"Computing snow metrics for tile {tile_id}.")
-    # A Dask LocalCluster speeds this script up 10X
-    client = Client(n_workers=9)
-    print("Monitor the Dask client dashboard for progress at the link below:")
-    print(client.dashboard_link)
-    if args.alt_input is not None:
-        alt_input = args.alt_input
-        logging.info(f"Using alternate input file: {alt_input}")
-        fp = preprocessed_dir / f"snow_year_{SNOW_YEAR}_{tile_id}_{alt_input}.nc"
-        chunky_ds = open_preprocessed_dataset(
-            fp, {"x": "auto", "y": "auto"}, "CGF_NDSI_Snow_Cover"
-        )
-        output_tag = alt_input
-    else:
-        fp = preprocessed_dir / f"snow_year_{SNOW_YEAR}_{tile_id}_filtered_filled.nc"
-        chunky_ds = open_preprocessed_dataset(
-            fp, {"x": "auto", "y": "auto"}, "CGF_NDSI_Snow_Cover"
-        )
-
-    logging.info(f"Applying Snow Cover Threshold...")
-    snow_is_on = apply_threshold(chunky_ds)
-    snow_metrics = dict()
-    snow_metrics.update({"first_snow_day": get_first_snow_day_array(snow_is_on)})
-    snow_metrics.update({"last_snow_day": get_last_snow_day_array(snow_is_on)})
-
-    snow_metrics.update(
-        {
-            "fss_range": compute_full_snow_season_range(
-                snow_metrics["last_snow_day"], snow_metrics["first_snow_day"]
-            )
-        }
-    )
-    snow_metrics.update({"snow_days": count_snow_days(snow_is_on)})
-    snow_metrics.update({"no_snow_days": count_no_snow_days(chunky_ds)})
-    snow_metrics.update(compute_css_metrics(snow_is_on))
-
-    # iterate through keys in snow_metrics dict and apply mask
-    combined_mask = mask_dir / f"{tile_id}__mask_combined_{SNOW_YEAR}.tif"
-    for metric_name, metric_array in snow_metrics.items():
-        snow_metrics[metric_name] = apply_mask(combined_mask, metric_array)
-
-    single_metric_profile = fetch_raster_profile(
-        tile_id, {"dtype": "int16", "nodata": 0}
-    )
-    for metric_name, metric_array in snow_metrics.items():
-        write_tagged_geotiff(
-            single_metric_dir,
-            tile_id,
-            "",
-            metric_name,
-            single_metric_profile,
-            metric_array.compute().values.astype("int16"),
-            # don't have to call .compute(), but communicates a chunked DataArray input
-        )
-    client.close()
-    chunky_ds.close()
-    print("Snow Metric Computation Script Complete.")
+    main(tile_id, args.alt_input)
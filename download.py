@@ -4,22 +4,32 @@ import requests
 import getpass
 import json
 import zipfile
-import io
 import math
 import os
 import shutil
-import re
 import sys
+import tempfile
+import threading
 import time
 import logging
 import calendar
 from statistics import mean
+from concurrent.futures import ThreadPoolExecutor
 from xml.etree import ElementTree as ET
-from datetime import datetime, timedelta
+from datetime import datetime
 
 from luts import short_name
 from config import viirs_params, snow_year_input_dir, SNOW_YEAR
 
+# CMR granule search maximum page size, fewer round trips per search
+cmr_page_size = 2000
+# concurrent zipped order downloads, within the default 10 connection pool of a session
+download_workers = 8
+# zipped orders are streamed to disk in pieces of this many bytes
+download_chunk_bytes = 8 * 1024 * 1024
+# orders are downloaded concurrently but extracted into the download directory one at a time
+extract_lock = threading.Lock()
+
 
 def wipe_old_downloads(dl_path):
     """Convenience function to prompt user to wipe prior downloads but retain the target directory. The baseline assumption is that all data in `$INPUT_DIR/$SNOW_YEAR` maps to a single cohesive processing run for a single snow year and set of tiles.
@@ -37,12 +47,12 @@ def wipe_old_downloads(dl_path):
                 "Wipe the contents of the target download directory? (y/n): "
             ).lower()
             if user_input == "y":
-                for filename in os.listdir(dl_path):
-                    filepath = os.path.join(dl_path, filename)
-                    try:
-                        shutil.rmtree(filepath)
-                    except OSError:
-                        os.remove(filepath)
+                with os.scandir(dl_path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            shutil.rmtree(entry.path)
+                        else:
+                            os.remove(entry.path)
                 print(f"Target path {dl_path} is now empty.")
             else:
                 print(
@@ -78,7 +88,7 @@ def determine_tiles_for_bbox(bounding_box):
     Args:
         bounding_box (str): The bounding box for the geographic area of interest.
     Returns:
-        set: VIIRS sinusoidal grid tiles that cover the bounding box.
+        frozenset: VIIRS sinusoidal grid tiles that cover the bounding box.
     """
     tile_search_url = (
         f"https://cmr.earthdata.nasa.gov/search/tiles?bounding_box={bounding_box}"
@@ -98,7 +108,7 @@ def determine_tiles_for_bbox(bounding_box):
             vstr = f"v{tile[1]}"
         tile_str = hstr + vstr
         tile_strs.append(tile_str)
-    reference_tiles = set(tile_strs)
+    reference_tiles = frozenset(tile_strs)
     logging.info(
         f"The following tiles are needed to cover your area of interest: {reference_tiles}"
     )
@@ -181,24 +191,26 @@ def search_granules(ds_latest_version, ds_short_name, tstart, tstop, bbox):
         "short_name": ds_short_name,
         "version": ds_latest_version,
         "temporal": f"{tstart},{tstop}",
-        "page_size": 100,
+        "page_size": cmr_page_size,
         "page_num": 1,
         "bounding_box": bbox,
     }
 
     granules = []
     headers = {"Accept": "application/json"}
-    while True:
-        response = requests.get(
-            granule_search_url, params=search_params, headers=headers
-        )
-        results = json.loads(response.content)
-        if len(results["feed"]["entry"]) == 0:
-            # out of results, break out of loop
-            break
-        # collect results and increment page_num
-        granules.extend(results["feed"]["entry"])
-        search_params["page_num"] += 1
+    # reuse one connection across pages
+    with requests.Session() as cmr_session:
+        while True:
+            response = cmr_session.get(
+                granule_search_url, params=search_params, headers=headers
+            )
+            results = json.loads(response.content)
+            # collect results and increment page_num
+            granules.extend(results["feed"]["entry"])
+            if len(results["feed"]["entry"]) < cmr_page_size:
+                # a short (or empty) page is the last one, break out of loop
+                break
+            search_params["page_num"] += 1
 
     logging.info(
         f"{len(granules)} granules of {ds_short_name} version {ds_latest_version} cover your area and time of interest."
@@ -217,7 +229,7 @@ def filter_granules_based_on_tiles(granules, ref):
 
     Args:
         granules (list): A list of candidate granules.
-        ref (set): A set of reference tiles.
+        ref (frozenset): A set of reference tiles.
     Returns:
         list: A list of granules that match the reference tiles.
     """
@@ -396,9 +408,43 @@ def make_async_data_orders(n_orders, session, dl_param_dict):
     return download_urls
 
 
+def download_and_extract_zip(session, dl_url, dl_path):
+    """Download a single zipped order and extract it.
+
+    The zip is streamed to a temporary file in the download directory rather than held in memory, since orders can be several GB.
+
+    Args:
+        session (requests.sessions.Session): authenticated session for making requests.
+        dl_url (str): URL for downloading the zipped order.
+        dl_path (pathlib.Path): target directory for downloading and extracting data
+
+    Returns:
+        None
+    """
+    logging.info(f"Beginning download of zipped output {dl_url}...")
+    # CP note: hacky retry loop, but did once get a "service unavailable" status when the request URL itself was valid. try 3x before giving up.
+    try:
+        for _ in range(3):
+            zip_response = session.get(dl_url, stream=True)
+            if zip_response.status_code == 200:
+                break
+            zip_response.close()
+            time.sleep(120)  # Pause for 2 minutes
+        zip_response.raise_for_status()
+    except requests.exceptions.HTTPError as e:
+        print(f"Error downloading zip file: {e}")
+    with zip_response, tempfile.TemporaryFile(dir=dl_path) as zip_file:
+        for chunk in zip_response.iter_content(chunk_size=download_chunk_bytes):
+            zip_file.write(chunk)
+        with extract_lock, zipfile.ZipFile(zip_file) as z:
+            z.extractall(dl_path)
+
+
 def download_order(session, download_urls, dl_path):
     """Download and extract the ordered data.
 
+    Orders are downloaded concurrently over the authenticated session's connection pool, whose default size (10) covers `download_workers`.
+
     Args:
         session (requests.sessions.Session): authenticated session for making requests.
         download_urls (list): URL(s) for downloading the ordered data.
@@ -407,22 +453,15 @@ def download_order(session, download_urls, dl_path):
     Returns:
         None
     """
-
-    for dl_url in download_urls:
-        logging.info("Beginning download of zipped output...")
-        zip_response = session.get(dl_url)
-        # CP note: hacky retry loop, but did once get a "service unavailable" status when the request URL itself was valid. try 3x before giving up.
-        try:
-            for _ in range(3):
-                zip_response = session.get(dl_url)
-                if zip_response.status_code == 200:
-                    break
-                time.sleep(120)  # Pause for 2 minutes
-            zip_response.raise_for_status()
-        except requests.exceptions.HTTPError as e:
-            print(f"Error downloading zip file: {e}")
-        with zipfile.ZipFile(io.BytesIO(zip_response.content)) as z:
-            z.extractall(dl_path)
+    if download_urls:
+        n_workers = min(len(download_urls), download_workers)
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            futures = [
+                executor.submit(download_and_extract_zip, session, dl_url, dl_path)
+                for dl_url in download_urls
+            ]
+            for future in futures:
+                future.result()
     logging.info("Data request is complete.")
 
 
@@ -459,7 +498,8 @@ def validate_download(dl_path, number_granules_requested):
         None
     """
     n_variables = 5  # CP note: consider parsing this as a var from the request
-    dl_file_count = sum(1 for x in dl_path.rglob("*") if x.is_file())
+    # os.walk is scandir-based and avoids a stat() call per file
+    dl_file_count = sum(len(files) for _, _, files in os.walk(dl_path))
     dl_files_expected = number_granules_requested * n_variables
     logging.info(f"{dl_file_count} files were downloaded.")
     if dl_file_count != dl_files_expected:
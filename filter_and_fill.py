@@ -3,17 +3,28 @@
 import os
 import argparse
 import logging
+from functools import lru_cache
 import xarray as xr
 import numpy as np
-from scipy.signal import savgol_filter
+from scipy.ndimage import convolve1d
+from scipy.signal import savgol_coeffs
 from dask.distributed import Client
 
 from config import (
     preprocessed_dir,
     SNOW_YEAR,
 )
-from luts import inv_cgf_codes
-from shared_utils import open_preprocessed_dataset, write_single_tile_xrdataset
+from luts import inv_cgf_codes, valid_snow_cover_codes
+from shared_utils import (
+    open_preprocessed_dataset,
+    make_uint8_encoding,
+    write_single_tile_xrdataset,
+)
+
+# whole time series per block, each block spans 2 x 2 of the 256 x 256 chunks on disk
+time_series_chunks = {"time": -1, "x": 512, "y": 512}
+# pixel time series filtered together, about 12 MiB per float64 or index temporary for a snow year
+filter_batch_pixels = 4096
 
 
 def is_low_illumination_for_solar_zenith(bitflag_value):
@@ -39,7 +50,24 @@ def is_snow_valid_and_nonzero(snowcover_value):
     Returns:
         bool: Whether or not the snowcover value is valid.
     """
-    return (snowcover_value >= 1) & (snowcover_value <= 100)
+    # one unsigned comparison: values below 1 wrap around above the largest valid code - 1
+    return (snowcover_value - 1).astype(np.uint8) <= valid_snow_cover_codes[-1] - 1
+
+
+def is_value_to_filter(snowcover_value, bitflag_value):
+    """Determine if a snowcover value is a filtering candidate: valid, nonzero, and observed under low illumination.
+
+    Applied per block so the filter mask is built from the snow cover and bit flag data in a single task instead of a chain of elementwise dask layers.
+
+    Args:
+        snowcover_value (np.array): The snowcover values.
+        bitflag_value (np.array): The bitflag values.
+    Returns:
+        np.array: Whether or not each value should be filtered.
+    """
+    return is_snow_valid_and_nonzero(
+        snowcover_value
+    ) & is_low_illumination_for_solar_zenith(bitflag_value)
 
 
 def identify_sections(mask):
@@ -63,28 +91,107 @@ def identify_sections(mask):
     ]
 
 
-def filter_data(snow_data, sections_to_filter, window_length=5, polyorder=1):
+@lru_cache
+def savgol_kernel(window_length, polyorder):
+    """Compute the Savitzky-Golay convolution coefficients once per window length and polynomial order.
+
+    Args:
+        window_length (int): The length of the filter window (number of coefficients).
+        polyorder (int): The order of the polynomial used to fit the samples.
+
+    Returns:
+        np.array: The filter coefficients, as used by `savgol_filter` for interior samples.
+    """
+    return savgol_coeffs(window_length, polyorder)
+
+
+def filter_data(snow_data, filter_mask, window_length=5, polyorder=1):
     """
-    Apply a Savitzky-Golay filter to specified sections of data.
+    Apply a Savitzky-Golay filter to every section of data along the last (time) axis of a block.
+
+    This is the block-wise equivalent of running `savgol_filter` over each section found by `identify_sections`, one pixel at a time. Pixels are filtered in batches of `filter_batch_pixels` so the float64 and index temporaries of `filter_pixel_batch` stay a few tens of MiB whatever the block size.
 
     Args:
-        snow_data (np.array): 1D array of snow cover data to filter.
-        sections_to_filter (list of slices): Sections of the data array to filter.
+        snow_data (np.array): N-D array of snow cover data to filter, with time as the last axis.
+        filter_mask (np.array): N-D boolean array indicating where to apply the filter.
         window_length (int): The length of the filter window (number of coefficients). window_length must be a positive odd integer.
         polyorder (int): The order of the polynomial used to fit the samples. polyorder must be less than window_length.
 
     Returns:
         np.array: The filtered data.
     """
-    filtered_data = snow_data.copy()
-    for section in sections_to_filter:
-        if (section.stop - section.start) < window_length:
-            # skip filtering for sections smaller than the window length
-            continue
-        filtered_data[section] = savgol_filter(
-            snow_data[section], window_length, polyorder
+    n_time = snow_data.shape[-1]
+    snow_pixels = snow_data.reshape(-1, n_time)
+    mask_pixels = filter_mask.reshape(-1, n_time)
+    filtered = np.empty_like(snow_pixels)
+    for start in range(0, snow_pixels.shape[0], filter_batch_pixels):
+        batch = slice(start, start + filter_batch_pixels)
+        filtered[batch] = filter_pixel_batch(
+            snow_pixels[batch], mask_pixels[batch], window_length, polyorder
         )
-    return filtered_data
+    return filtered.reshape(snow_data.shape)
+
+
+def filter_pixel_batch(snow_data, filter_mask, window_length, polyorder):
+    """
+    Apply a Savitzky-Golay filter to every section of a batch of pixel time series at once.
+
+    Interior elements come from the same Savitzky-Golay convolution `savgol_filter` uses, and elements within half a window of a section edge from the same polynomial fit to the edge window, so results match the per-pixel loop while the Python-level work is a handful of array operations per batch.
+
+    Args:
+        snow_data (np.array): 2D array of snow cover data to filter, shaped (pixel, time).
+        filter_mask (np.array): 2D boolean array indicating where to apply the filter.
+        window_length (int): The length of the filter window (number of coefficients).
+        polyorder (int): The order of the polynomial used to fit the samples.
+
+    Returns:
+        np.array: The filtered data.
+    """
+    n_time = snow_data.shape[-1]
+    half_window = window_length // 2
+    t = np.arange(n_time)
+
+    # first and last index of the run of True values containing each element
+    no_neighbor = np.zeros_like(filter_mask[..., :1])
+    is_start = filter_mask & ~np.concatenate([no_neighbor, filter_mask[..., :-1]], -1)
+    is_end = filter_mask & ~np.concatenate([filter_mask[..., 1:], no_neighbor], -1)
+    run_start = np.maximum.accumulate(np.where(is_start, t, 0), axis=-1)
+    run_end = np.flip(
+        np.minimum.accumulate(np.flip(np.where(is_end, t, n_time - 1), -1), axis=-1),
+        -1,
+    )
+
+    # match `identify_sections`: a section stops short of the last element of its run
+    # and sections smaller than the window length are not filtered
+    to_filter = filter_mask & (t < run_end) & ((run_end - run_start) >= window_length)
+
+    # center of the fitted window and the position of each element within it
+    window_center = np.clip(t, run_start + half_window, run_end - 1 - half_window)
+    window_center = np.where(to_filter, window_center, t)
+    window_pos = t - window_center + half_window
+
+    # interior elements use the same convolution as `savgol_filter`
+    snow_data_float = snow_data.astype(np.float64)
+    fitted = convolve1d(
+        snow_data_float,
+        savgol_kernel(window_length, polyorder),
+        axis=-1,
+        mode="constant",
+    )
+
+    # elements near a section edge use a polynomial fit to the edge window
+    is_edge = to_filter & (window_pos != half_window)
+    edge_index = is_edge.nonzero()
+    edge_start = window_center[is_edge] - half_window
+    edge_windows = np.stack(
+        [
+            snow_data_float[edge_index[:-1] + (edge_start + k,)]
+            for k in range(window_length)
+        ]
+    )
+    edge_coeffs = np.polyfit(np.arange(window_length), edge_windows, polyorder)
+    fitted[is_edge] = np.polyval(edge_coeffs, window_pos[is_edge])
+    return np.where(to_filter, fitted.astype(snow_data.dtype), snow_data)
 
 
 def fill_obscured_values_with_adjacent_observations(snow_data, sections_to_fill):
@@ -136,11 +243,6 @@ def construct_result(original_data, modified_data, mask):
 def apply_filter_and_fill_to_masked_sections(
     snow_data, mask_data, window_length=5, polyorder=1
 ):
-    def filter_section(data, filter_mask):
-        sections_to_filter = identify_sections(filter_mask)
-        filtered_data = filter_data(data, sections_to_filter, window_length, polyorder)
-        return construct_result(data, filtered_data, filter_mask)
-
     def fill_section(data, obscured_mask):
         sections_to_filter = identify_sections(obscured_mask)
         filled_data = fill_obscured_values_with_adjacent_observations(
@@ -150,13 +252,14 @@ def apply_filter_and_fill_to_masked_sections(
 
     snow_data_dtype = snow_data.dtype
     # first pass the Savitzky-Golay filter over the low illumination observations
+    # filter_data works on whole blocks, so no per-pixel vectorization here
     filtered_snow_data = xr.apply_ufunc(
-        filter_section,
+        filter_data,
         snow_data,
         mask_data,
         input_core_dims=[["time"], ["time"]],
         output_core_dims=[["time"]],
-        vectorize=True,
+        kwargs={"window_length": window_length, "polyorder": polyorder},
         dask="parallelized",
         output_dtypes=[snow_data_dtype],
     )
@@ -187,6 +290,53 @@ def apply_filter_and_fill_to_masked_sections(
     return cloud_filled_snow_data
 
 
+def main(tile_id):
+    """Filter low illumination observations and fill cloud and night gaps for a single tile.
+
+    Args:
+        tile_id (str): The tile identifier.
+    Returns:
+        None
+    """
+    with Client() as client:
+        print("Monitor the Dask client dashboard for progress.")
+        print(client.dashboard_link)
+
+        fp = preprocessed_dir / f"snow_year_{SNOW_YEAR}_{tile_id}.nc"
+        snow_ds = open_preprocessed_dataset(
+            fp, time_series_chunks, "CGF_NDSI_Snow_Cover"
+        )
+        bitflag_ds = open_preprocessed_dataset(
+            fp, time_series_chunks, "Algorithm_Bit_Flags_QA"
+        )
+        mask_data = xr.apply_ufunc(
+            is_value_to_filter,
+            snow_ds,
+            bitflag_ds,
+            dask="parallelized",
+            output_dtypes=[bool],
+        )
+        # function that opens this is context managed, but I'm paranoid
+        bitflag_ds.close()
+
+        filtered_and_filled_data = apply_filter_and_fill_to_masked_sections(
+            snow_ds, mask_data, window_length=5, polyorder=1
+        ).compute()
+        snow_ds.close()  # expect context, but still paranoid so manually closing
+
+        filtered_and_filled_data.name = "CGF_NDSI_Snow_Cover"
+        write_single_tile_xrdataset(
+            filtered_and_filled_data,
+            tile_id,
+            "filtered_filled",
+            encoding=make_uint8_encoding(
+                filtered_and_filled_data, ["CGF_NDSI_Snow_Cover"]
+            ),
+        )
+
+    print("Filtering and filling Complete.")
+
+
 if __name__ == "__main__":
     log_file_path = os.path.join(os.path.expanduser("~"), "filter_and_fill.log")
     logging.basicConfig(filename=log_file_path, level=logging.INFO)
@@ -196,31 +346,4 @@ if __name__ == "__main__":
     parser.add_argument("tile_id", type=str, help="VIIRS Tile ID (ex. h11v02)")
     args = parser.parse_args()
     tile_id = args.tile_id
-    client = Client()
-    print("Monitor the Dask client dashboard for progress.")
-    print(client.dashboard_link)
-
-    fp = preprocessed_dir / f"snow_year_{SNOW_YEAR}_{tile_id}.nc"
-    snow_ds = open_preprocessed_dataset(
-        fp, {"x": "auto", "y": "auto"}, "CGF_NDSI_Snow_Cover"
-    )
-    bitflag_ds = open_preprocessed_dataset(
-        fp, {"x": "auto", "y": "auto"}, "Algorithm_Bit_Flags_QA"
-    )
-    snow_valid_is_true = is_snow_valid_and_nonzero(snow_ds)
-    low_illumination_is_true = is_low_illumination_for_solar_zenith(bitflag_ds)
-    # function that opens this is context managed, but I'm paranoid
-    bitflag_ds.close()
-    value_to_filter_is_true = snow_valid_is_true & low_illumination_is_true
-    mask_data = value_to_filter_is_true > 0
-
-    filtered_and_filled_data = apply_filter_and_fill_to_masked_sections(
-        snow_ds, mask_data, window_length=5, polyorder=1
-    ).compute()
-    snow_ds.close()  # expect context, but still paranoid so manually closing
-
-    filtered_and_filled_data.name = "CGF_NDSI_Snow_Cover"
-    write_single_tile_xrdataset(filtered_and_filled_data, tile_id, "filtered_filled")
-
-    client.close()
-    print("Filtering and filling Complete.")
+    main(tile_id)
@@ -4,11 +4,13 @@ import argparse
 import logging
 import os
 
+import numpy as np
 from dask.distributed import Client
 
 from config import SNOW_YEAR, preprocessed_dir, uncertainty_dir
 from luts import inv_cgf_codes
 from shared_utils import (
+    netcdf_chunks,
     open_preprocessed_dataset,
     fetch_raster_profile,
     write_tagged_geotiff,
@@ -25,7 +27,9 @@ def count_no_decision_occurence(ds_chunked):
         xarray.DataArray: count of "No decision" values".
     """
     logging.info(f"Counting occurence of `No decision` values...")
-    no_decision_count = (ds_chunked == inv_cgf_codes["No decision"]).sum(dim="time")
+    no_decision_count = (ds_chunked == inv_cgf_codes["No decision"]).sum(
+        dim="time", dtype=np.int32
+    )
     return no_decision_count
 
 
@@ -40,7 +44,7 @@ def count_missing_l1b_occurence(ds_chunked):
     """
     logging.info(f"Counting occurence of `Missing L1B data` values...")
     missing_l1b_count = (ds_chunked == inv_cgf_codes["Missing L1B data"]).sum(
-        dim="time"
+        dim="time", dtype=np.int32
     )
     return missing_l1b_count
 
@@ -56,7 +60,7 @@ def count_l1b_calibration_fail(ds_chunked):
     """
     logging.info(f"Counting occurence of `L1B data failed calibration` values...")
     l1b_fail_count = (ds_chunked == inv_cgf_codes["L1B data failed calibration"]).sum(
-        dim="time"
+        dim="time", dtype=np.int32
     )
     return l1b_fail_count
 
@@ -72,7 +76,7 @@ def count_bowtie_trim(ds_chunked):
     """
     logging.info(f"Counting occurence of `Onboard VIIRS bowtie trim` values...")
     bowtie_trim_count = (ds_chunked == inv_cgf_codes["Onboard VIIRS bowtie trim"]).sum(
-        dim="time"
+        dim="time", dtype=np.int32
     )
     return bowtie_trim_count
 
@@ -107,18 +111,14 @@ if __name__ == "__main__":
     uncertainty_data = dict()
     fp = preprocessed_dir / f"snow_year_{SNOW_YEAR}_{tile_id}.nc"
 
-    cgf_snow_ds = open_preprocessed_dataset(
-        fp, {"x": "auto", "y": "auto"}, "CGF_NDSI_Snow_Cover"
-    )
+    cgf_snow_ds = open_preprocessed_dataset(fp, netcdf_chunks, "CGF_NDSI_Snow_Cover")
     uncertainty_data.update({"no decision": count_no_decision_occurence(cgf_snow_ds)})
     uncertainty_data.update({"missing L1B": count_missing_l1b_occurence(cgf_snow_ds)})
     uncertainty_data.update({"L1B fail": count_l1b_calibration_fail(cgf_snow_ds)})
     uncertainty_data.update({"bowtie trim": count_bowtie_trim(cgf_snow_ds)})
     cgf_snow_ds.close()
 
-    cloud_ds = open_preprocessed_dataset(
-        fp, {"x": "auto", "y": "auto"}, "Cloud_Persistence"
-    )
+    cloud_ds = open_preprocessed_dataset(fp, netcdf_chunks, "Cloud_Persistence")
     uncertainty_data.update(
         {"max_cloud_persistence": get_max_cloud_persistence(cgf_snow_ds)}
     )
@@ -29,7 +29,9 @@ cgf_snow_cover_codes = {
     255: "L2 fill",
 }
 # CP note: inverting above to reference array values by the descriptive string
-inv_cgf_codes = {v: k for k, v in cgf_snow_cover_codes.items()}
+# codes 0-100 share one description, so only the single-valued codes are inverted
+inv_cgf_codes = {v: k for k, v in cgf_snow_cover_codes.items() if k > 100}
+valid_snow_cover_codes = range(101)
 
 snow_cover_threshold = 50
 n_obs_to_classify_ocean = 10
@@ -1,59 +1,37 @@
 # VIIRS snow metrics post-processing: reproject, mosaic, stack.
 import os
+import re
 import subprocess
 import logging
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 from config import (
     tiff_path_dict,
     SNOW_YEAR,
 )
 
-
-def reproject_to_3338(target_dir, dst_dir):
-    """Reproject all GeoTIFF files in a target directory to EPSG:3338.
-
-    Spawns a `gdalwarp` subprocess with these parameters:
-    `gdalwarp -t_srs EPSG:3338 -r nearest -tr 375 375 src.tif dst.tif`
-
-    Args:
-        target_dir (str): Path to the directory containing the reprojected GeoTIFF files.
-        dst_dir (str): Path to the directory to save the reprojected GeoTIFF files.
-
-    Returns: None
-    """
-
-    for file_name in os.listdir(target_dir):
-        if file_name.endswith(".tif"):
-            base = os.path.basename(file_name)
-            name, _ = os.path.splitext(base)
-
-            output = f"{name}_3338.tif"
-            # gdalwarp it
-            log_text = subprocess.run(
-                [
-                    "gdalwarp",
-                    "-overwrite",
-                    "-tap",
-                    "-t_srs",
-                    "EPSG:3338",
-                    "-r",
-                    "nearest",
-                    "-tr",
-                    "375",
-                    "375",
-                    "-co",
-                    "COMPRESS=DEFLATE",
-                    "-co",
-                    "NUM_THREADS=ALL_CPUS",
-                    os.path.join(target_dir, file_name),
-                    os.path.join(dst_dir, output),
-                ],
-                capture_output=True,
-                text=True,
-            )
-            logging.info(log_text.stdout)
-            logging.error(log_text.stderr)
+# single-tile GeoTIFFs are named like {tile}__{tag}_{SNOW_YEAR}.tif
+# where the tag is a metric name or a mask / uncertainty tag (e.g., mask_ocean)
+metric_tag_re = re.compile(r"__(?P<tag>.+)_\d{4}\.tif$")
+
+# number of metric groups merged concurrently, each gdalwarp is also multithreaded
+merge_workers = 4
+# CPUs and memory are split across the concurrent gdalwarp processes so that together
+# they use the machine's cores and 2 GiB each of warp buffer and block cache
+merge_threads = max(1, (os.cpu_count() or 1) // merge_workers)
+merge_memory_mb = 2048 // merge_workers
+
+# GDAL configuration for the gdalwarp subprocesses
+# the default block cache (5% of RAM) is too small to hold a full mosaic
+gdal_env = {
+    **os.environ,
+    "GDAL_CACHEMAX": str(merge_memory_mb),
+    "GDAL_NUM_THREADS": str(merge_threads),
+    "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+    "VSI_CACHE": "TRUE",
+    "VSI_CACHE_SIZE": str(1_000_000_000 // merge_workers),
+}
 
 
 def group_files_by_metric(target_dir):
@@ -62,7 +40,7 @@ def group_files_by_metric(target_dir):
     Returns a dictionary with metric or variable names as keys and lists of file paths as values.
 
     Args:
-        target_dir (str): Path to the directory containing the reprojected GeoTIFF files.
+        target_dir (str): Path to the directory containing the single-tile GeoTIFF files.
 
     Returns:
         dict: {metric: [file1, file2, ...]}
@@ -70,22 +48,21 @@ def group_files_by_metric(target_dir):
 
     geotiff_groups = defaultdict(list)
 
-    for filename in os.listdir(target_dir):
-        if filename.endswith("3338.tif"):
-            # consider parse_metric function in shared utils
-            # tag_to_group = "".join(filename.split("__")[1].split("_")[0:-2])
-            tag_to_group = filename.split("__")[1].rsplit("_", 2)[0]
-            # above line likely to fail for uncertainty or mask files
-            # perhaps the parsing function should be provided as a function to this argument
-            geotiff_groups[tag_to_group].append(os.path.join(target_dir, filename))
+    with os.scandir(target_dir) as entries:
+        for entry in entries:
+            tag_match = metric_tag_re.search(entry.name)
+            if tag_match:
+                geotiff_groups[tag_match.group("tag")].append(entry.path)
 
     return geotiff_groups
 
 
 def merge_geotiffs(file_list, output_file):
-    """Merge a list of GeoTIFF files into a single GeoTIFF file.
+    """Reproject and merge a list of single-tile GeoTIFF files into a single EPSG:3338 GeoTIFF file.
+
+    Spawns one `gdalwarp` subprocess that reprojects and mosaics the tiles in a single pass, writing a ZSTD-compressed Cloud Optimized GeoTIFF. No intermediate per-tile EPSG:3338 GeoTIFFs or VRT are written.
 
-    Spawns a `gdalbuildvrt` subprocess to create a VRT file from the list of files, then a `gdal_translate` subprocess to convert the VRT to a GeoTIFF.
+    `-multi` overlaps I/O with computation and `-wo NUM_THREADS` parallelizes the warp kernel itself (the `NUM_THREADS` creation option only applies to compression). Threads and memory are limited to this process's share (`merge_threads`, `merge_memory_mb`) since `merge_workers` merges run at once.
 
     Args:
         file_list (list): List of file paths to merge.
@@ -93,51 +70,44 @@ def merge_geotiffs(file_list, output_file):
 
     Returns: None
     """
-    # creating a temp textfile to pipe into gdalbuildvrt
-    merge_list_file = "list_of_files_to_merge.txt"
-    with open(merge_list_file, "w") as f:
-        f.write("\n".join(file_list))
-
-    # gdalbuildvrt - this is an intermediate file we will throw away
-    vrt_file = "output.vrt"
     log_text = subprocess.run(
         [
-            "gdalbuildvrt",
-            "-input_file_list",
-            merge_list_file,
-            "-resolution",
-            "highest",
+            "gdalwarp",
+            "-overwrite",
+            "-multi",
+            "-wo",
+            f"NUM_THREADS={merge_threads}",
+            "-wm",
+            str(merge_memory_mb),
+            "-tap",
+            "-t_srs",
+            "EPSG:3338",
             "-r",
             "nearest",
-            vrt_file,
-        ],
-        capture_output=True,
-        text=True,
-    )
-    logging.info(log_text.stdout)
-    logging.error(log_text.stderr)
-
-    # gdal_translate converts the VRT to a GeoTIFF
-    log_text = subprocess.run(
-        [
-            "gdal_translate",
+            "-tr",
+            "375",
+            "375",
             "-of",
-            "GTiff",
+            "COG",
+            "-co",
+            "COMPRESS=ZSTD",
+            "-co",
+            "PREDICTOR=2",
             "-co",
-            "COMPRESS=DEFLATE",
+            "BLOCKSIZE=512",
             "-co",
-            "NUM_THREADS=ALL_CPUS",
-            vrt_file,
+            f"NUM_THREADS={merge_threads}",
+            *file_list,
             output_file,
         ],
-        capture_output=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
         text=True,
+        env=gdal_env,
     )
-    logging.info(log_text.stdout)
-    logging.error(log_text.stderr)
-    # cull the temp files
-    os.remove(merge_list_file)
-    os.remove(vrt_file)
+    # progress output is discarded, errors are only logged on failure
+    if log_text.returncode:
+        logging.error(log_text.stderr)
 
 
 if __name__ == "__main__":
@@ -145,20 +115,26 @@ if __name__ == "__main__":
     logging.basicConfig(filename=log_file_path, level=logging.INFO)
 
     for tiff_flavor in tiff_path_dict.keys():
-        logging.info(f"Reprojecting {tiff_flavor} to EPSG:3338...")
-        reproject_to_3338(
-            tiff_path_dict[tiff_flavor]["creation"],
-            tiff_path_dict[tiff_flavor]["reprojected"],
-        )
-        logging.info("Reprojection complete.")
-
-        file_groups = group_files_by_metric(tiff_path_dict[tiff_flavor]["reprojected"])
-        for tag, file_list in file_groups.items():
-            logging.info(f"Mosaicing {tiff_flavor} {tag}...")
-            dst = (
-                tiff_path_dict[tiff_flavor]["merged"] / f"{tag}_merged_{SNOW_YEAR}.tif"
-            )
-            merge_geotiffs(file_list, dst)
-            logging.info(f"Mosaicing {tiff_flavor} {tag} complete.")
+        file_groups = group_files_by_metric(tiff_path_dict[tiff_flavor]["creation"])
+        if not file_groups:
+            continue
+        logging.info(f"Reprojecting and mosaicing {tiff_flavor} {list(file_groups)}...")
+        # groups are independent, so merge several at once
+        # threads suffice because the work happens in the gdalwarp subprocesses
+        with ThreadPoolExecutor(
+            max_workers=min(len(file_groups), merge_workers)
+        ) as executor:
+            futures = [
+                executor.submit(
+                    merge_geotiffs,
+                    file_list,
+                    tiff_path_dict[tiff_flavor]["merged"]
+                    / f"{tag}_merged_{SNOW_YEAR}.tif",
+                )
+                for tag, file_list in file_groups.items()
+            ]
+            for future in futures:
+                future.result()
+        logging.info(f"Reprojecting and mosaicing {tiff_flavor} complete.")
 
     logging.info("Postprocessing complete.")
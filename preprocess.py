@@ -1,23 +1,34 @@
 """Preprocess the downloaded VIIRS GeoTIFFs to a time-indexed netCDF dataset that represents all data for a single snow year."""
 
 import argparse
+import json
 import logging
-import pickle
 import os
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 import xarray as xr
 import rasterio as rio
 import numpy as np
 import pandas as pd
 import rioxarray
+import dask
 import dask.array as da
 
-from config import snow_year_input_dir
+from config import snow_year_input_dir, raster_profiles_fp
 from luts import data_variables
-from shared_utils import parse_tile, list_input_files, write_single_tile_xrdataset
+from shared_utils import (
+    parse_tile,
+    list_input_files,
+    make_uint8_encoding,
+    write_single_tile_xrdataset,
+)
 
+# threads for opening the reference GeoTIFF of each tile
+reference_read_workers = 8
 
+
+@lru_cache(maxsize=None)
 def parse_date(fp):
     """Parse the date from the filename.
     Args:
@@ -29,6 +40,7 @@ def parse_date(fp):
     return fp.name.split("_")[1][1:]
 
 
+@lru_cache(maxsize=None)
 def parse_data_variable(fp):
     """Parse the data variable from the filename.
 
@@ -41,6 +53,7 @@ def parse_data_variable(fp):
     return fp.name.split("2D_")[1].split(".")[0][:-9]
 
 
+@lru_cache(maxsize=None)
 def parse_satellite(fp):
     """Parse the satellite from the filename. This function is not used at the moment, but may be used in the future to distiguish the VIIRS sensors that are aboard different satellites including Suomi NPP, NOAA-20, NOAA-21, and satellites to be launched in the future.
 
@@ -53,25 +66,26 @@ def parse_satellite(fp):
     return fp.name.split("_")[0]
 
 
-def convert_yyyydoy_to_date(doy_str):
-    """Convert a YYYY-DOY string to a datetime object that can be used as an xr.DataSet time index.
+def convert_yyyydoy_to_dates(doy_strs):
+    """Convert many YYYY-DOY strings at once to a time index that can be used as an xr.DataSet time index.
 
     Args:
-       doy_str (str): The date in YYYY-DOY format.
+       doy_strs (list): dates in YYYY-DOY format, already in chronological order.
 
     Returns:
-       date: date object (e.g., datetime.date(2019, 12, 4))
+       pd.DatetimeIndex: the dates, in the order given.
     """
-    year, doy = int(doy_str[0:4]), int(doy_str[-3:])
-    date = datetime(year, 1, 1) + timedelta(days=doy - 1)
-    return date.date()
+    return pd.to_datetime(list(doy_strs), format="%Y%j")
 
 
+@lru_cache
 def construct_file_dict(fps):
     """Construct a dict mapping tiles and data variables to file paths.
 
+    The result is cached so that tiles preprocessed in the same process build the dict and persist the reference raster profiles once. Treat the returned dict as read-only.
+
     Args:
-       fps (list): A list of file paths.
+       fps (tuple): The file paths, as returned by `list_input_files`.
 
     Returns:
        (dict): hierarchical dict with keys of tile>>>data_variable that map to the file paths of the downloaded GeoTIFFs.
@@ -85,79 +99,114 @@ def construct_file_dict(fps):
         if data_var not in di[tile]:
             di[tile][data_var] = []
         di[tile][data_var].append(fp)
-    # persist the dict as pickle for later reference
-    with open("file_dict.pickle", "wb") as handle:
-        pickle.dump(di, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    persist_reference_profiles(di)
     return di
 
 
-def initialize_transform(geotiff):
-    """Initialize the affine transform from a reference GeoTIFF.
+def read_reference_profile(geotiff):
+    """Read the raster creation profile of a GeoTIFF in a JSON serializable form.
 
     Args:
-       geotiff (Path): Path to the reference GeoTIFF.
+       geotiff (Path): The reference GeoTIFF file path.
 
     Returns:
-       transform: The Affine transform object from the reference GeoTIFF.
+       dict: The raster profile with the CRS as WKT and the transform as its six affine coefficients.
     """
     with rio.open(geotiff) as src:
-        transform = src.transform
-    return transform
+        profile = dict(src.profile)
+    profile["crs"] = profile["crs"].to_wkt()
+    profile["transform"] = list(profile["transform"])[:6]
+    return profile
 
 
-def initialize_latlon(geotiff):
-    """Initialize latitude and longitude for xr.DataSet dimensions from the boundaries and shape of a reference GeoTIFF.
+def persist_reference_profiles(tile_di):
+    """Persist the raster creation profile of each tile's reference GeoTIFF as JSON.
+
+    Each reference GeoTIFF is opened once here so that `fetch_raster_profile` can build output profiles without opening any raster. The CRS is stored as WKT and the transform as its six affine coefficients. Tiles without any snow cover GeoTIFFs are logged and skipped so they do not stop the other tiles from being preprocessed.
 
     Args:
-       geotiff (Path): Path to a reference GeoTIFF.
+       tile_di (dict): A dictionary mapping tiles and data variables to file paths.
 
     Returns:
-       tuple: (longitude, latitude) values.
+       None
     """
-    with rio.open(geotiff) as src:
-        lon, lat = np.meshgrid(
-            np.linspace(src.bounds.left, src.bounds.right, src.meta["width"]),
-            np.linspace(src.bounds.bottom, src.bounds.top, src.meta["height"]),
+    # a tile without snow cover files has no reference GeoTIFF, and cannot be preprocessed
+    tiles = [tile for tile in tile_di if tile_di[tile].get("CGF_NDSI_Snow_Cover")]
+    for tile in tile_di.keys() - set(tiles):
+        logging.warning(
+            f"No CGF_NDSI_Snow_Cover files found for tile {tile}, a reference raster profile will not be persisted."
         )
-    return lon, lat
+    references = [tile_di[tile]["CGF_NDSI_Snow_Cover"][0] for tile in tiles]
+    # opening a GeoTIFF is I/O bound and rasterio releases the GIL
+    with ThreadPoolExecutor(max_workers=reference_read_workers) as executor:
+        profiles = dict(zip(tiles, executor.map(read_reference_profile, references)))
+    tmp_fp = raster_profiles_fp.with_name(
+        f"{raster_profiles_fp.name}.{os.getpid()}.tmp"
+    )
+    with open(tmp_fp, "w") as handle:
+        json.dump(profiles, handle)
+    os.replace(tmp_fp, raster_profiles_fp)
 
 
-def initialize_crs(geotiff):
-    """Initialize the coordinate reference system from metadata of a reference GeoTIFF.
+@lru_cache(maxsize=None)
+def initialize_reference_metadata(geotiff):
+    """Initialize the affine transform, the latitude and longitude for xr.DataSet dimensions, and the coordinate reference system from a reference GeoTIFF.
+
+    The reference GeoTIFF is opened once for all three. Results are cached per reference GeoTIFF.
 
     Args:
-       geotiff (Path): Path to a GeoTIFF.
+       geotiff (Path): Path to the reference GeoTIFF.
 
     Returns:
-       crs: CRS from the reference GeoTIFF.
+       tuple: (transform, longitude, latitude, crs) where longitude and latitude are 1-D arrays derived from the boundaries and shape of the reference GeoTIFF.
     """
     with rio.open(geotiff) as src:
-        return src.crs
+        lon = np.linspace(src.bounds.left, src.bounds.right, src.meta["width"])
+        lat = np.linspace(src.bounds.bottom, src.bounds.top, src.meta["height"])
+        return src.transform, lon, lat, src.crs
 
 
-def make_sorted_raster_stack(files, yyyydoy_strings):
-    """Create an in-memory raster stack sorted by date.
+def read_single_band(geotiff):
+    """Read the first band of a GeoTIFF.
 
-    This function takes a list of file paths and a list of chronological (pre-sorted)dates in YYYY-DOY format. It first creates a list of files that match the dates in the list. Then, it opens each of these files, reads the raster data from them, and appends it to the raster stack.
+    Args:
+       geotiff (Path): Path to the GeoTIFF.
+
+    Returns:
+       numpy.ndarray: uint8 raster values.
+    """
+    with rio.open(geotiff) as src:
+        # all snow cover codes and QA flags fit in 8 bits
+        return src.read(1).astype(np.uint8, copy=False)
+
+
+def make_sorted_raster_stack(files, yyyydoy_strings, shape):
+    """Create a lazy raster stack sorted by date.
+
+    This function takes a list of file paths and a list of chronological (pre-sorted)dates in YYYY-DOY format. It first maps each file to its date and looks up the files in date order. Then, it wraps a delayed read of each file in a Dask array so that rasters are only read when a chunk is needed (e.g., when the dataset is written to disk), rather than holding the whole (time, y, x) cube in memory.
 
     Args:
        files (list): list of file paths.
        yyyydoy_strings (list): chronologically sorted dates in YYYY-DOY format.
+       shape (tuple): (height, width) shared by every raster of the tile, taken from the reference GeoTIFF.
 
       Returns:
-         list: list of rasters (i.e. a stack) sorted by date.
+         dask.array.Array: uint8 raster stack sorted by date.
     """
-    # create an in-memory raster stack
-    sorted_files = []
-    for yyyydoy in yyyydoy_strings:
-        for f in files:
-            if yyyydoy == parse_date(f):
-                sorted_files.append(f)
-
-    raster_stack = []
-    for file in sorted_files:
-        with rio.open(file) as src:
-            raster_stack.append(src.read(1))
+    # single pass over the files, then look up each date
+    files_by_date = {parse_date(f): f for f in files}
+    sorted_files = [
+        files_by_date[yyyydoy]
+        for yyyydoy in yyyydoy_strings
+        if yyyydoy in files_by_date
+    ]
+
+    lazy_rasters = [
+        da.from_delayed(dask.delayed(read_single_band)(f), shape=shape, dtype=np.uint8)
+        for f in sorted_files
+    ]
+    # one block per raster, write_single_tile_xrdataset rechunks to the on-disk chunks
+    raster_stack = da.stack(lazy_rasters, axis=0)
     return raster_stack
 
 
@@ -173,32 +222,30 @@ def create_single_tile_dataset(tile_di, tile):
     """
     # assuming all files have same metadata, use first for metadata
     reference_geotiff = tile_di[tile]["CGF_NDSI_Snow_Cover"][0]
-    transform = initialize_transform(reference_geotiff)
-    lon, lat = initialize_latlon(reference_geotiff)
-    crs = initialize_crs(reference_geotiff)
+    transform, lon, lat, crs = initialize_reference_metadata(reference_geotiff)
 
     # timestamps are indentical across variables, use snowcover
-    dates = [
-        convert_yyyydoy_to_date(parse_date(x))
-        for x in tile_di[tile]["CGF_NDSI_Snow_Cover"]
-    ]
-    dates.sort()
-    yyyydoy_strings = [d.strftime("%Y") + d.strftime("%j") for d in dates]
+    # YYYYDOY strings sort chronologically, so sort them as parsed and only
+    # convert to timestamps once for the time coordinate
+    yyyydoy_strings = sorted(
+        parse_date(x) for x in tile_di[tile]["CGF_NDSI_Snow_Cover"]
+    )
+    dates = convert_yyyydoy_to_dates(yyyydoy_strings)
 
     ds_dict = dict()
     ds_coords = {
-        "time": pd.DatetimeIndex(dates),
-        "x": lon[0, :],
-        "y": lat[:, 0],
+        "time": dates,
+        "x": lon,
+        "y": lat,
     }
 
     # CP note: if testing just use CGF snow [data_variables[1]]
     for data_var in data_variables:
         logging.info(f"Stacking data for {data_var}...")
         raster_stack = make_sorted_raster_stack(
-            tile_di[tile][data_var], yyyydoy_strings
+            tile_di[tile][data_var], yyyydoy_strings, (lat.size, lon.size)
         )
-        data_var_dict = {data_var: (["time", "y", "x"], da.array(raster_stack))}
+        data_var_dict = {data_var: (["time", "y", "x"], raster_stack)}
         ds_dict.update(data_var_dict)
 
     logging.info(f"Creating dataset...")
@@ -211,21 +258,33 @@ def create_single_tile_dataset(tile_di, tile):
     return ds
 
 
-if __name__ == "__main__":
-    log_file_path = os.path.join(os.path.expanduser("~"), "datacube_preprocess.log")
-    logging.basicConfig(filename=log_file_path, level=logging.INFO)
-
-    parser = argparse.ArgumentParser(description="Preprocessing Script")
-    parser.add_argument("tile_id", type=str, help="VIIRS Tile ID (ex. h11v02)")
-    args = parser.parse_args()
-    tile_id = args.tile_id
+def main(tile_id):
+    """Create and write the preprocessed dataset for a single tile.
 
+    Args:
+        tile_id (str): The tile identifier.
+    Returns:
+        None
+    """
     logging.info(f"Creating preprocessed dataset for tile {tile_id}...")
 
     geotiffs = list_input_files(snow_year_input_dir)
     geotiff_di = construct_file_dict(geotiffs)
     tile_ds = create_single_tile_dataset(geotiff_di, tile_id)
-    write_single_tile_xrdataset(tile_ds, tile_id)
+    write_single_tile_xrdataset(
+        tile_ds, tile_id, encoding=make_uint8_encoding(tile_ds, data_variables)
+    )
 
     logging.info(f"Creating preprocessed dataset for tile {tile_id} complete.")
     print("Preprocessing Script Complete.")
+
+
+if __name__ == "__main__":
+    log_file_path = os.path.join(os.path.expanduser("~"), "datacube_preprocess.log")
+    logging.basicConfig(filename=log_file_path, level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Preprocessing Script")
+    parser.add_argument("tile_id", type=str, help="VIIRS Tile ID (ex. h11v02)")
+    args = parser.parse_args()
+    tile_id = args.tile_id
+    main(tile_id)
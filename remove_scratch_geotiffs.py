@@ -1,17 +1,27 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
+
 from config import snow_year_scratch_dir
+from shared_utils import iter_files_with_suffix
 
-geotiff_files = list(snow_year_scratch_dir.rglob("*.tif"))
+# stream the directory walk to count files without holding every path
+n_files = sum(1 for _ in iter_files_with_suffix(snow_year_scratch_dir, ".tif"))
 
 # prompt to confirm deletion
 print(
-    f"Are you sure you want to delete {len(geotiff_files)} GeoTIFF files from {snow_year_scratch_dir}? (yes/no)"
+    f"Are you sure you want to delete {n_files} GeoTIFF files from {snow_year_scratch_dir}? (yes/no)"
 )
 confirmation = input()
 
 if confirmation.lower() == "yes":
-    for file in geotiff_files:
-        os.remove(file)
-    print(f"Deleted {len(geotiff_files)} GeoTIFF files from {snow_year_scratch_dir}.")
+    # unlinks are metadata round-trips on network filesystems, overlap them
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        n_deleted = sum(
+            1
+            for _ in executor.map(
+                os.remove, iter_files_with_suffix(snow_year_scratch_dir, ".tif")
+            )
+        )
+    print(f"Deleted {n_deleted} GeoTIFF files from {snow_year_scratch_dir}.")
 else:
     print("Operation cancelled.")
@@ -1,17 +1,27 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
+
 from config import snow_year_scratch_dir
+from shared_utils import iter_files_with_suffix
 
-netcdf_files = list(snow_year_scratch_dir.rglob("*.nc"))
+# stream the directory walk to count files without holding every path
+n_files = sum(1 for _ in iter_files_with_suffix(snow_year_scratch_dir, ".nc"))
 
 # prompt to confirm deletion
 print(
-    f"Are you sure you want to delete {len(netcdf_files)} NetCDF files from {snow_year_scratch_dir}? (yes/no)"
+    f"Are you sure you want to delete {n_files} NetCDF files from {snow_year_scratch_dir}? (yes/no)"
 )
 confirmation = input()
 
 if confirmation.lower() == "yes":
-    for file in netcdf_files:
-        os.remove(file)
-    print(f"Deleted {len(netcdf_files)} NetCDF files from {snow_year_scratch_dir}.")
+    # unlinks are metadata round-trips on network filesystems, overlap them
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        n_deleted = sum(
+            1
+            for _ in executor.map(
+                os.remove, iter_files_with_suffix(snow_year_scratch_dir, ".nc")
+            )
+        )
+    print(f"Deleted {n_deleted} NetCDF files from {snow_year_scratch_dir}.")
 else:
     print("Operation cancelled.")
@@ -1,29 +1,69 @@
 """Utility functions used across multiple modules."""
+import json
 import logging
-import pickle
+import os
+from functools import lru_cache
+from pathlib import Path
 
+import numpy as np
 import xarray as xr
 import rasterio as rio
+from affine import Affine
+from rasterio.crs import CRS
 
-from luts import snow_cover_threshold
-from config import SNOW_YEAR, preprocessed_dir
+from luts import snow_cover_threshold, valid_snow_cover_codes
+from config import SNOW_YEAR, preprocessed_dir, raster_profiles_fp
 
+# edge length of the (time, y, x) chunks of preprocessed netCDF files
+netcdf_chunk_edge = 256
+# dask chunks matching the stored chunks, one decompression per dask block
+netcdf_chunks = {"time": -1, "y": netcdf_chunk_edge, "x": netcdf_chunk_edge}
 
+
+@lru_cache
 def list_input_files(src_dir):
     """List all .tif files in the source directory.
 
+    The listing is cached, so when tiles are processed in-process the input directory is only scanned once. Entries are streamed with `os.scandir`, whose cached file types avoid a stat per entry.
+
     Args:
        src_dir (Path): The source directory containing the .tif files.
 
     Returns:
-       list: A list of all .tif files in the source directory.
+       tuple: All .tif files in the source directory.
     """
-    fps = [x for x in src_dir.glob("*.tif")]
+    with os.scandir(src_dir) as entries:
+        fps = tuple(
+            Path(entry.path)
+            for entry in entries
+            if entry.name.endswith(".tif")
+            and not entry.name.startswith(".")
+            and entry.is_file()
+        )
     logging.info(f"Downloaded file count is {len(fps)}.")
     logging.info(f"Files that will be included in dataset: {fps}.")
     return fps
 
 
+def iter_files_with_suffix(root, suffix):
+    """Recursively yield paths of files with a given suffix, streaming directory entries with `os.scandir`.
+
+    Args:
+       root (Path): The directory to search.
+       suffix (str): The file suffix to match (e.g., ".tif").
+
+    Returns:
+       generator: paths (str) of the matching files.
+    """
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_files_with_suffix(entry.path, suffix)
+            elif entry.name.endswith(suffix):
+                yield entry.path
+
+
+@lru_cache(maxsize=None)
 def parse_tile(fp):
     """Parse the VIIRS tile ID from the filename.
 
@@ -39,59 +79,96 @@ def parse_tile(fp):
 def open_preprocessed_dataset(fp, chunk_dict, data_variable=None):
     """Open a preprocessed dataset for a given tile.
 
+    Values are returned in their stored dtype (uint8 for snow cover and QA variables) without CF mask and scale decoding. Each call opens the file anew, so callers own (and may close) the returned object.
+
     Args:
         fp (Path): Path to xarray DataSet
         chunk_dict (dict): how to chunk the dataset, like `{"time": 52}`
+        data_variable (str): optional single data variable to return
 
     Returns:
        xr.Dataset: The chunked dataset.
     """
     logging.info(f"Opening preprocessed file {fp} as chunked Dataset...")
+    # keep the stored uint8 values, CF masking would promote them to float
+    ds = xr.open_dataset(fp, mask_and_scale=False)
     if data_variable is not None:
-        with xr.open_dataset(fp)[data_variable].chunk(chunk_dict) as ds_chunked:
-            return ds_chunked
-    else:
-        with xr.open_dataset(fp).chunk(chunk_dict) as ds_chunked:
-            return ds_chunked
+        ds = ds[data_variable]
+    return ds.chunk(chunk_dict)
+
+
+def make_uint8_encoding(ds, data_vars):
+    """Build a netCDF encoding for uint8 snow cover and QA variables.
 
+    Variables are compressed with Blosc LZ4 + bitshuffle, which decodes much faster than DEFLATE, and chunked so that each chunk holds the full time series of a 256 x 256 block (about 24 MB for a full snow year), matching the per-pixel time series reads of the downstream stages. Chunk sizes follow each variable's own dimension order, since netCDF applies them by position and e.g. `xr.apply_ufunc` output is ordered (y, x, time). No _FillValue is set so that 255 (L2 fill) is not decoded to NaN and promoted to float.
+
+    Args:
+        ds (xr.Dataset or xr.DataArray): The single-tile data to be written.
+        data_vars (list): names of the variables to encode.
 
-def write_single_tile_xrdataset(ds, tile, suffix=None):
+    Returns:
+        dict: encoding to pass to `write_single_tile_xrdataset`.
+    """
+    encoding = dict()
+    for data_var in data_vars:
+        data_array = ds if isinstance(ds, xr.DataArray) else ds[data_var]
+        chunksizes = tuple(
+            size if dim == "time" else min(netcdf_chunk_edge, size)
+            for dim, size in zip(data_array.dims, data_array.shape)
+        )
+        encoding[data_var] = {
+            "dtype": "uint8",
+            "_FillValue": None,
+            "compression": "blosc_lz4",
+            "blosc_shuffle": 2,
+            "complevel": 5,
+            "chunksizes": chunksizes,
+        }
+    return encoding
+
+
+def write_single_tile_xrdataset(ds, tile, suffix=None, encoding=None):
     """Write the DataSet to a netCDF file.
 
     Args:
        ds (xr.Dataset): The single-tile dataset.
        tile (str): The tile being processed.
        suffix (str): An optional suffix to append to the filename.
+       encoding (dict): Optional per-variable netCDF encoding, e.g. `{"CGF_NDSI_Snow_Cover": {"dtype": "uint8"}}`
     """
     if suffix is not None:
         filename = preprocessed_dir / f"snow_year_{SNOW_YEAR}_{tile}_{suffix}.nc"
     else:
         filename = preprocessed_dir / f"snow_year_{SNOW_YEAR}_{tile}.nc"
-    ds.to_netcdf(filename)
+    if ds.chunks:
+        # align dask chunks with the on-disk chunks so each stored chunk is written once
+        ds = ds.chunk(netcdf_chunks)
+    ds.to_netcdf(filename, encoding=encoding)
     logging.info(f"NetCDF dataset for tile {tile} wriiten to {filename}.")
 
 
 def apply_threshold(chunked_cgf_snow_cover):
     """Apply the snow cover threshold to the CGF snow cover datacube. Grid cells exceeding the threshold value are considered to be snow-covered.
 
-    Note that 100 is the maximum valid snow cover value.
+    Note that 100 (the last of `valid_snow_cover_codes`) is the maximum valid snow cover value.
+
+    Both bounds are checked with a single unsigned comparison: shifting by (threshold + 1) and wrapping to uint8 sends values at or below the threshold to the top of the 0-255 range, so only values in (threshold, 100] remain at or below (100 - threshold - 1). This produces one temporary per chunk instead of two boolean arrays and an extra `&` pass.
 
     Args:
         chunked_cgf_snow_cover (xr.DataArray): preprocessed CGF snow cover datacube
 
     Returns:
         snow_on (xr.DataArray): boolean values representing snow cover"""
-    snow_on = (chunked_cgf_snow_cover > snow_cover_threshold) & (
-        chunked_cgf_snow_cover <= 100
-    )
+    shifted = (chunked_cgf_snow_cover - (snow_cover_threshold + 1)).astype(np.uint8)
+    snow_on = shifted <= (valid_snow_cover_codes[-1] - snow_cover_threshold - 1)
     return snow_on
 
 
 def fetch_raster_profile(tile_id, updates=None):
     """Fetch a raster profile to generate output mask rasters that match the downloaded NSIDC rasters.
 
-    We load the GeoTIFF hash table to quicly extract a reference raster creation profile. Preserving these profiles should make the final alignment /
-    mosaicking of the raster products a smoother process. We can also use this hash table to perform intermittent QC checks. For example, say FSD = 100 for some grid cell. We should then be able to map that value (100) to a date, then check the GeoTIFFs for that date, the date prior, and the date after, and observe the expected behavior (snow condition toggling from off to on).
+    We load the reference raster creation profiles persisted during preprocessing, so no raster needs to be opened. Preserving these profiles should make the final alignment /
+    mosaicking of the raster products a smoother process. We can also use the downloaded GeoTIFFs of each tile to perform intermittent QC checks. For example, say FSD = 100 for some grid cell. We should then be able to map that value (100) to a date, then check the GeoTIFFs for that date, the date prior, and the date after, and observe the expected behavior (snow condition toggling from off to on).
 
     Args:
         tile_id (str): The tile identifier.
@@ -100,17 +177,39 @@ def fetch_raster_profile(tile_id, updates=None):
         dict: The raster profile.
     """
 
-    with open("file_dict.pickle", "rb") as handle:
-        geotiff_dict = pickle.load(handle)
-    geotiff_reference = geotiff_dict[tile_id]["CGF_NDSI_Snow_Cover"][0]
-    with rio.open(geotiff_reference) as src:
-        out_profile = src.profile
+    out_profile = dict(load_reference_profile(tile_id))
     if updates is not None:
         out_profile.update(updates)
     logging.info(f"GeoTIFFs will use the raster creation profile {out_profile}.")
     return out_profile
 
 
+@lru_cache
+def load_reference_profiles():
+    """Load the reference raster creation profiles persisted during preprocessing.
+
+    Returns:
+        dict: raster creation profile (with serialized CRS and transform) for each tile
+    """
+    with open(raster_profiles_fp, "r") as handle:
+        return json.load(handle)
+
+
+@lru_cache
+def load_reference_profile(tile_id):
+    """Build the reference raster creation profile of a tile.
+
+    Args:
+        tile_id (str): The tile identifier.
+    Returns:
+        dict: The raster profile with CRS and transform objects. Treat as read-only, callers should copy before modifying.
+    """
+    profile = dict(load_reference_profiles()[tile_id])
+    profile["crs"] = CRS.from_wkt(profile["crs"])
+    profile["transform"] = Affine(*profile["transform"])
+    return profile
+
+
 def apply_mask(mask_fp, array_to_mask):
     """Mask out values from an array.
 
@@ -121,12 +220,46 @@ def apply_mask(mask_fp, array_to_mask):
         xr.DataArray: masked array where masked values are set to 0
     """
 
-    with rio.open(mask_fp) as src:
-        mask_arr = src.read(1)
-    mask_applied = mask_arr * array_to_mask
+    mask_arr = read_mask(mask_fp)
+    # select rather than multiply so the metric dtype is preserved
+    mask_applied = array_to_mask.where(mask_arr, 0)
     return mask_applied
 
 
+@lru_cache
+def read_mask(mask_fp):
+    """Read a mask GeoTIFF once as a boolean array.
+
+    Args:
+        mask_fp (str): file path to the mask GeoTIFF
+    Returns:
+        numpy.ndarray: True where data is valid
+    """
+    with rio.Env(**gdal_env_options), rio.open(mask_fp) as src:
+        mask_arr = src.read(1).astype(bool)
+    mask_arr.flags.writeable = False
+    return mask_arr
+
+
+# GDAL settings for GeoTIFF reads and writes: multithreaded compression, no sibling
+# file listing on open, and no temporary file detour for random-access writes
+gdal_env_options = {
+    "GDAL_NUM_THREADS": "ALL_CPUS",
+    "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+    "CPL_VSIL_USE_TEMP_FILE_FOR_RANDOM_WRITE": "NO",
+}
+
+geotiff_creation_options = {
+    "tiled": True,
+    "blockxsize": 512,
+    "blockysize": 512,
+    "compress": "zstd",
+    "zstd_level": 1,
+    "predictor": 2,
+    "num_threads": "ALL_CPUS",
+}
+
+
 def write_tagged_geotiff(dst_dir, tile_id, tag_name, tag_value, out_profile, arr):
     """Write data to a GeoTIFF file.
 
@@ -137,7 +270,7 @@ def write_tagged_geotiff(dst_dir, tile_id, tag_name, tag_value, out_profile, arr
         tile_id (str): The tile identifier.
         tag_name (str): The name of the metadata tag.
         tag_value (str): Value of the metadata tag.
-        out_profile (dict): The raster profile.
+        out_profile (dict): The raster profile. Tiling and ZSTD compression options are always applied on top of it, with the predictor left out for sub-byte (`nbits` < 8) profiles.
         arr (numpy.ndarray): The mask array.
 
     Returns:
@@ -145,7 +278,12 @@ def write_tagged_geotiff(dst_dir, tile_id, tag_name, tag_value, out_profile, arr
     """
     out_fp = dst_dir / f"{tile_id}_{tag_name}_{tag_value}_{SNOW_YEAR}.tif"
     logging.info(f"Writing GeoTIFF to {out_fp}.")
-    with rio.open(out_fp, "w", **out_profile) as dst:
+    # tiled + compressed so block reads during mosaicking touch only one tile
+    out_profile = {**out_profile, **geotiff_creation_options}
+    if out_profile.get("nbits", 8) < 8:
+        # GDAL only applies horizontal differencing to whole-byte samples
+        del out_profile["predictor"]
+    with rio.Env(**gdal_env_options), rio.open(out_fp, "w", **out_profile) as dst:
         dst.update_tags(tag_name=tag_value)
         dst.write(arr, 1)
     return None
@@ -3,7 +3,14 @@
 import os
 import subprocess
 import argparse
-
+import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import preprocess
+import filter_and_fill
+import compute_masks
+import compute_snow_metrics
 from config import snow_year_input_dir
 from shared_utils import list_input_files, parse_tile
 
@@ -13,6 +20,24 @@ def trigger_download():
     print("Download complete.")
 
 
+def positive_int(value):
+    """Parse a command line argument as an integer of at least 1.
+
+    Args:
+        value (str): The command line argument.
+
+    Returns:
+        int: The parsed value.
+    """
+    try:
+        parsed = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value!r} is not an integer")
+    if parsed < 1:
+        raise argparse.ArgumentTypeError(f"{parsed} is less than 1")
+    return parsed
+
+
 def get_unique_tiles_in_input_directory():
     """Get the unique tiles in the input directory.
 
@@ -20,58 +45,90 @@ def get_unique_tiles_in_input_directory():
         list: A list of unique tiles in the input directory.
     """
     fps = list_input_files(snow_year_input_dir)
-    tiles_to_process = set([parse_tile(fp) for fp in fps])
-    return list(tiles_to_process)
-
-
-def trigger_preprocess(tile_id):
-    result = subprocess.check_output(["python", "./preprocess.py", tile_id])
-    print(result)
-    print("Preprocessing complete.")
-
-
-def trigger_filter_fill(tile_id):
+    return list({parse_tile(fp) for fp in fps})
+
+
+# per-tile stages in run order: (command line flag, entry point, script, description)
+tile_stages = [
+    ("preprocess", preprocess.main, "preprocess.py", "Preprocessing"),
+    ("filter_fill", filter_and_fill.main, "filter_and_fill.py", "Filter and fill"),
+    ("compute_masks", compute_masks.main, "compute_masks.py", "Mask computation"),
+    (
+        "compute_metrics",
+        compute_snow_metrics.main,
+        "compute_snow_metrics.py",
+        "Snow metrics computation",
+    ),
+]
+
+
+def trigger_stage(script, description, *script_args):
+    """Run a processing script in a subprocess and report its output.
+
+    Args:
+        script (str): file name of the script to run
+        description (str): name of the stage used in progress messages
+        *script_args (str): command line arguments for the script, e.g. the tile ID
+    Returns:
+        bool: True if the script completed without error
+    """
     try:
         result = subprocess.check_output(
-            ["python", "./filter_and_fill.py", tile_id], stderr=subprocess.STDOUT
+            ["python", f"./{script}", *script_args], stderr=subprocess.STDOUT
         )
-        print(result)
+        logging.info(result.decode())
     except subprocess.CalledProcessError as e:
+        logging.error(f"{description} failed for {script_args}: {e.output.decode()}")
         print("Error occurred:", e.output.decode())
-    print("Filter and fill complete.")
+        return False
+    logging.info(f"{description} complete for {script_args}.")
+    return True
 
 
-def trigger_compute_masks(tile_id):
-    try:
-        result = subprocess.check_output(
-            ["python", "./compute_masks.py", tile_id], stderr=subprocess.STDOUT
-        )
-        print(result)
-    except subprocess.CalledProcessError as e:
-        print("Error occurred:", e.output.decode())
-    print("Mask computation complete.")
+def trigger_stage_in_process(stage_main, description, *stage_args):
+    """Run a processing stage by calling its entry point in this interpreter.
 
+    This skips the interpreter startup and library imports a subprocess pays for every tile and stage.
 
-def trigger_compute_snow_metrics(tile_id):
+    Args:
+        stage_main (function): the `main` function of the stage module
+        description (str): name of the stage used in progress messages
+        *stage_args (str): arguments for the entry point, e.g. the tile ID
+    Returns:
+        bool: True if the stage completed without error
+    """
     try:
-        result = subprocess.check_output(
-            ["python", "./compute_snow_metrics.py", tile_id], stderr=subprocess.STDOUT
-        )
-        print(result)
-    except subprocess.CalledProcessError as e:
-        print("Error occurred:", e.output.decode())
-    print("Snow metrics computation complete.")
+        stage_main(*stage_args)
+    except Exception:
+        logging.exception(f"{description} failed for {stage_args}.")
+        print("Error occurred:", traceback.format_exc())
+        return False
+    logging.info(f"{description} complete for {stage_args}.")
+    return True
 
 
-def trigger_postprocess():
-    try:
-        result = subprocess.check_output(
-            ["python", "./postprocess.py"], stderr=subprocess.STDOUT
-        )
-        print(result)
-    except subprocess.CalledProcessError as e:
-        print("Error occurred:", e.output.decode())
-    print("Postprocessing complete.")
+def run_tile_stages(tile_id, args):
+    """Run the requested per-tile stages, in order, for a single tile.
+
+    Later stages read the outputs of earlier ones, so the remaining stages are skipped for a tile once a stage fails. When tiles are processed one at a time the stages are called in-process. Concurrent tiles use a subprocess per stage, because every stage starts and stops its own Dask client and a client is process-global.
+
+    Args:
+        tile_id (str): The tile identifier.
+        args (argparse.Namespace): parsed command line flags selecting the stages to run
+    Returns:
+        None
+    """
+    logging.info(f"Processing tile {tile_id}.")
+    in_process = args.parallel_tiles == 1
+    for flag, stage_main, script, description in tile_stages:
+        if not getattr(args, flag):
+            continue
+        if in_process:
+            completed = trigger_stage_in_process(stage_main, description, tile_id)
+        else:
+            completed = trigger_stage(script, description, tile_id)
+        if not completed:
+            return None
 
 
 if __name__ == "__main__":
@@ -96,28 +153,26 @@ if __name__ == "__main__":
     parser.add_argument(
         "--postprocess", action="store_true", help="Trigger postprocessing"
     )
+    parser.add_argument(
+        "--parallel_tiles",
+        type=positive_int,
+        default=1,
+        help="Number of tiles to process concurrently (each stage starts its own Dask cluster, so size this to the machine)",
+    )
 
     args = parser.parse_args()
+    log_file_path = os.path.join(os.path.expanduser("~"), "snow_metric_runner.log")
+    logging.basicConfig(filename=log_file_path, level=logging.INFO)
 
     if args.download:
         trigger_download()
 
     tile_ids = get_unique_tiles_in_input_directory()
-    for tile_id in tile_ids:
-        print(tile_id)
-        if args.preprocess:
-            trigger_preprocess(tile_id)
-
-        if args.filter_fill:
-            trigger_filter_fill(tile_id)
-
-        if args.compute_masks:
-            trigger_compute_masks(tile_id)
-
-        if args.compute_metrics:
-            trigger_compute_snow_metrics(tile_id)
+    # tiles are independent, stages within a tile run in order
+    with ThreadPoolExecutor(max_workers=args.parallel_tiles) as executor:
+        list(executor.map(lambda tile_id: run_tile_stages(tile_id, args), tile_ids))
 
     if args.postprocess:
-        trigger_postprocess()
+        trigger_stage("postprocess.py", "Postprocessing")
 
     print("All tasks complete.")